@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import hmac
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+# Capacity limits (per backend process)
+MAX_CONCURRENT_DOCS = int(os.getenv("ADMISSION_MAX_DOCS", "4"))
+MAX_INFLIGHT_PAGES = int(os.getenv("ADMISSION_MAX_PAGES", "80"))
+MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+QUEUE_DEADLINE_S = float(os.getenv("ADMISSION_QUEUE_DEADLINE", "60"))
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "bulk": 1}
+DEFAULT_PRIORITY = "bulk"
+# X-Priority is client-supplied. When this key is set, "interactive" is only granted
+# to requests that also send a matching X-Priority-Key; everything else runs as bulk.
+# When it is unset the header is advisory: any client can ask to jump the queue.
+INTERACTIVE_KEY = os.getenv("ADMISSION_INTERACTIVE_KEY", "")
+
+def resolve_priority(value: str | None, key: str | None = None) -> str:
+    value = (value or "").strip().lower()
+    if value not in PRIORITIES:
+        return DEFAULT_PRIORITY
+    if value != DEFAULT_PRIORITY and INTERACTIVE_KEY and not hmac.compare_digest((key or "").encode(), INTERACTIVE_KEY.encode()):
+        return DEFAULT_PRIORITY
+    return value
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Caps documents and rasterized pages in flight. Requests over capacity wait in a
+    bounded priority queue (interactive before bulk, FIFO within a class) and are
+    rejected with 429 when the queue is full or 503 when their wait deadline passes.
+    Runs entirely on the event loop, so no locking is needed.
+    """
+    def __init__(self, max_docs: int = MAX_CONCURRENT_DOCS, max_pages: int = MAX_INFLIGHT_PAGES,
+                 max_queue: int = MAX_QUEUE_DEPTH, deadline_s: float = QUEUE_DEADLINE_S):
+        self.max_docs = max_docs
+        self.max_pages = max_pages
+        self.max_queue = max_queue
+        self.deadline_s = deadline_s
+        self._active_docs = 0
+        self._inflight_pages = 0
+        self._waiters = []  # heap of [rank, seq, pages, future, priority]
+        self._seq = itertools.count()
+        self._avg_doc_s = 30.0
+        self._peak_queue_depth = 0
+        self._admitted = {p: 0 for p in PRIORITIES}
+        self._rejected_queue_full = {p: 0 for p in PRIORITIES}
+        self._rejected_timeout = {p: 0 for p in PRIORITIES}
+
+    def _fits(self, pages: int) -> bool:
+        return self._active_docs < self.max_docs and self._inflight_pages + pages <= self.max_pages
+
+    def _grant(self, pages: int, priority: str) -> None:
+        self._active_docs += 1
+        self._inflight_pages += pages
+        self._admitted[priority] += 1
+
+    def _wake(self) -> None:
+        # Strict head-of-line: a large document at the head is not starved by smaller ones behind it
+        while self._waiters and self._fits(self._waiters[0][2]):
+            _, _, pages, fut, priority = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._grant(pages, priority)
+            fut.set_result(None)
+
+    def retry_after(self) -> int:
+        est = self._avg_doc_s * (len(self._waiters) + 1) / max(1, self.max_docs)
+        return int(min(300, max(1, math.ceil(est))))
+
+    def check_capacity(self, priority: str) -> None:
+        """Fails fast before an upload is stored if the wait queue is already full."""
+        if len(self._waiters) >= self.max_queue:
+            self._rejected_queue_full[priority] += 1
+            raise AdmissionRejected(429, "Server busy: analysis queue is full.", self.retry_after())
+
+    async def acquire(self, pages: int, priority: str) -> int:
+        """Waits for capacity. Returns the page count actually reserved."""
+        # A document larger than the page budget may still run, just alone
+        pages = min(max(1, pages), self.max_pages)
+        if not self._waiters and self._fits(pages):
+            self._grant(pages, priority)
+            return pages
+        self.check_capacity(priority)
+        fut = asyncio.get_running_loop().create_future()
+        entry = [PRIORITIES[priority], next(self._seq), pages, fut, priority]
+        heapq.heappush(self._waiters, entry)
+        self._peak_queue_depth = max(self._peak_queue_depth, len(self._waiters))
+        # An interactive request may jump a bulk head that is still waiting for room
+        self._wake()
+        try:
+            await asyncio.wait_for(fut, timeout=self.deadline_s)
+            return pages
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # Granted in the same tick the deadline fired
+                return pages
+            self._remove_waiter(entry)
+            self._rejected_timeout[priority] += 1
+            logging.warning(f"Admission deadline expired ({priority}, {pages} pages)")
+            raise AdmissionRejected(503, "Server busy: timed out waiting for capacity.", self.retry_after())
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(pages, 0.0)
+            self._remove_waiter(entry)
+            raise
+
+    def _remove_waiter(self, entry: list) -> None:
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        self._wake()
+
+    def release(self, pages: int, elapsed_s: float) -> None:
+        self._active_docs -= 1
+        self._inflight_pages -= pages
+        if elapsed_s > 0:
+            self._avg_doc_s = 0.8 * self._avg_doc_s + 0.2 * elapsed_s
+        self._wake()
+
+    @asynccontextmanager
+    async def admit(self, pages: int, priority: str):
+        reserved = await self.acquire(pages, priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(reserved, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        by_priority = {p: 0 for p in PRIORITIES}
+        for entry in self._waiters:
+            by_priority[entry[4]] += 1
+        return {
+            "limits": {
+                "max_docs": self.max_docs,
+                "max_pages": self.max_pages,
+                "max_queue": self.max_queue,
+                "queue_deadline_s": self.deadline_s,
+            },
+            "active_docs": self._active_docs,
+            "inflight_pages": self._inflight_pages,
+            "queue_depth": len(self._waiters),
+            "queue_depth_by_priority": by_priority,
+            "peak_queue_depth": self._peak_queue_depth,
+            "admitted": dict(self._admitted),
+            "rejected_queue_full": dict(self._rejected_queue_full),
+            "rejected_timeout": dict(self._rejected_timeout),
+            "avg_doc_seconds": round(self._avg_doc_s, 2),
+            "retry_after_s": self.retry_after(),
+        }
@@ -0,0 +1,123 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+# Debug output directory; each submission gets its own sub-folder
+DEBUG_DIR = "debug_output"
+
+# off   → nothing written
+# text  → OCR text dump per submission
+# final → + chosen binarized image per page
+# all   → + every OCR variant per page (A_norotate, B_osd, C_deskew)
+LEVELS = {"off": 0, "text": 1, "final": 2, "all": 3}
+DEBUG_LEVEL = os.getenv("DEBUG_ARTIFACTS_LEVEL", "text").lower()
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_ARTIFACTS_SAMPLE_RATE", "1.0"))
+# Bytes held by queued, not-yet-written artifacts. One 300 DPI page is ~8.7 MB,
+# so the default keeps only a few pages in memory at final/all.
+WRITER_QUEUE_MB = float(os.getenv("DEBUG_ARTIFACTS_QUEUE_MB", "32"))
+
+_write_queue: queue.Queue = queue.Queue()
+_writer_lock = threading.Lock()
+_writer_thread: threading.Thread | None = None
+_stats_lock = threading.Lock()
+_stats = {"written": 0, "dropped": 0, "failed": 0, "queued": 0, "queued_bytes": 0}
+
+def _payload_size(payload) -> int:
+    if isinstance(payload, np.ndarray):
+        return payload.nbytes
+    return len(payload)
+
+def _write_artifact(path: str, payload) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(payload, np.ndarray):
+        Image.fromarray(payload).save(path)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(payload)
+
+def _writer_loop() -> None:
+    while True:
+        path, payload, size = _write_queue.get()
+        try:
+            _write_artifact(path, payload)
+            outcome = "written"
+        except Exception as e:
+            outcome = "failed"
+            logging.error(f"Debug artifact write failed ({path}): {e}")
+        with _stats_lock:
+            _stats[outcome] += 1
+            _stats["queued"] -= 1
+            _stats["queued_bytes"] -= size
+        _write_queue.task_done()
+
+def _ensure_writer() -> None:
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="debug-artifacts", daemon=True)
+            _writer_thread.start()
+
+def _enqueue(path: str, payload) -> bool:
+    # Never block the OCR path: if the writer is behind, drop the artifact
+    _ensure_writer()
+    size = _payload_size(payload)
+    with _stats_lock:
+        if _stats["queued_bytes"] + size > WRITER_QUEUE_MB * 1024 * 1024:
+            _stats["dropped"] += 1
+            logging.warning(f"Debug artifact queue full; dropped {path}")
+            return False
+        _stats["queued"] += 1
+        _stats["queued_bytes"] += size
+    _write_queue.put_nowait((path, payload, size))
+    return True
+
+def get_writer_stats() -> dict:
+    with _stats_lock:
+        return {**_stats, "queue_limit_mb": WRITER_QUEUE_MB}
+
+def flush_debug_artifacts(timeout_s: float = 10.0) -> None:
+    """Waits (up to timeout_s) for queued artifacts to be written. For shutdown only."""
+    deadline = time.monotonic() + timeout_s
+    while _write_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+class DebugArtifacts:
+    """
+    Debug artifact sink for one submission. Writes go to DEBUG_DIR/<submission_id>/
+    through the background writer; callers never wait on disk I/O.
+    """
+    def __init__(self, submission_id: str, level: str = "off"):
+        self.submission_id = submission_id
+        self.level = level if level in LEVELS else "off"
+        self.dir = os.path.join(DEBUG_DIR, submission_id)
+
+    def wants(self, level: str) -> bool:
+        return LEVELS[self.level] >= LEVELS[level] > 0
+
+    def save_text(self, name: str, text: str) -> str | None:
+        if not self.wants("text"):
+            return None
+        path = os.path.join(self.dir, name)
+        return path if _enqueue(path, text) else None
+
+    def save_image(self, name: str, image: np.ndarray, level: str = "all") -> str | None:
+        if not self.wants(level):
+            return None
+        path = os.path.join(self.dir, name)
+        return path if _enqueue(path, image) else None
+
+def start_debug_session(submission_id: str) -> DebugArtifacts:
+    """Applies the configured level and per-request sampling for a new submission."""
+    level = DEBUG_LEVEL
+    if level != "off" and random.random() >= DEBUG_SAMPLE_RATE:
+        level = "off"
+    return DebugArtifacts(submission_id, level)
+
+NO_DEBUG = DebugArtifacts("", "off")
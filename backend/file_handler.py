@@ -1,15 +1,22 @@
 import os
 import uuid
 import re
+import io
+import json
+import zipfile
 from datetime import datetime
-from fastapi import UploadFile, HTTPException
-from pdf2image import convert_from_path
+from fastapi import HTTPException
+from pdf2image import convert_from_path, pdfinfo_from_path
 UPLOAD_DIR = os.path.join("storage", "uploads")
 TEMP_IMAGE_DIR = os.path.join("storage", "images")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(TEMP_IMAGE_DIR, exist_ok=True)
 ALLOWED_EXTENSIONS = [".pdf"]
 MAX_FILE_SIZE_MB = 10
+MAX_PAGES = 40
+ZIP_MANIFEST_NAME = "manifest.json"
+MAX_ZIP_TOTAL_MB = int(os.getenv("MAX_ZIP_TOTAL_MB", "100"))
+MAX_MANIFEST_KB = 256
 def is_allowed_file(filename: str) -> bool:
     return any(filename.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS)
 def sanitize_filename(filename: str) -> str:
@@ -21,13 +28,23 @@ def get_upload_dir() -> str:
     return UPLOAD_DIR
 def get_timestamp() -> str:
     return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-def convert_pdf_to_images(pdf_path: str, output_folder: str, dpi: int = 300, max_pages: int | None = 40) -> list:
+def count_pdf_pages(pdf_path: str, max_pages: int | None = MAX_PAGES) -> int:
+    """
+    Cheap page count (pdfinfo) used to reserve capacity before rasterizing.
+    Falls back to max_pages when the PDF cannot be inspected.
+    """
+    try:
+        pages = int(pdfinfo_from_path(pdf_path).get("Pages", 0))
+    except Exception:
+        return max_pages or 1
+    return min(pages, max_pages) if max_pages else pages
+def convert_pdf_to_images(pdf_path: str, output_folder: str, dpi: int = 300, max_pages: int | None = MAX_PAGES) -> list:
     """
     Converts a PDF to images. max_pages protects memory/time for demos.
     Returns a list of image file paths.
     """
     os.makedirs(output_folder, exist_ok=True)
-    images = convert_from_path(pdf_path, dpi=dpi)
+    images = convert_from_path(pdf_path, dpi=dpi, last_page=max_pages)
     if max_pages:
         images = images[:max_pages]
     image_paths = []
@@ -36,25 +53,86 @@ def convert_pdf_to_images(pdf_path: str, output_folder: str, dpi: int = 300, max
         img.save(img_path, "PNG")
         image_paths.append(img_path)
     return image_paths
-async def save_uploaded_file(file: UploadFile, submission_id: str) -> dict:
-    if not is_allowed_file(file.filename):
+def save_upload_bytes(filename: str, contents: bytes, submission_id: str) -> dict:
+    """
+    Persists raw PDF bytes for a submission. Shared by single and batch uploads.
+    """
+    if not is_allowed_file(filename):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
-    safe_name = sanitize_filename(file.filename)
-    filename = f"{submission_id}_{safe_name}"
-    save_path = os.path.join(UPLOAD_DIR, filename)
-    contents = await file.read()
+    safe_name = sanitize_filename(filename)
+    stored_name = f"{submission_id}_{safe_name}"
+    save_path = os.path.join(UPLOAD_DIR, stored_name)
     file_size_mb = len(contents) / (1024 * 1024)
     if file_size_mb > MAX_FILE_SIZE_MB:
         raise HTTPException(status_code=413, detail=f"File too large. Max allowed is {MAX_FILE_SIZE_MB} MB.")
     with open(save_path, "wb") as buffer:
         buffer.write(contents)
-    image_output_dir = os.path.join(TEMP_IMAGE_DIR, submission_id)
-    image_paths = convert_pdf_to_images(save_path, image_output_dir, dpi=300, max_pages=40)
     return {
-        "filename": filename,
+        "filename": stored_name,
         "path": save_path,
         "uploaded_at": get_timestamp(),
         "size_mb": round(file_size_mb, 2),
-        "image_paths": image_paths,
-        "image_dir": image_output_dir
-    }
\ No newline at end of file
+    }
+def discard_upload(save_result: dict) -> None:
+    try:
+        os.remove(save_result["path"])
+    except OSError:
+        pass
+def rasterize_upload(save_result: dict, submission_id: str) -> dict:
+    image_output_dir = os.path.join(TEMP_IMAGE_DIR, submission_id)
+    image_paths = convert_pdf_to_images(save_result["path"], image_output_dir, dpi=300, max_pages=MAX_PAGES)
+    return {**save_result, "image_paths": image_paths, "image_dir": image_output_dir}
+def read_pdfs_from_zip(data: bytes, max_files: int) -> tuple:
+    """
+    Unpacks a batch archive. An optional manifest.json maps PDF names to PO numbers.
+    Member count and total uncompressed size are checked from the zip directory
+    before anything is decompressed.
+    Returns: ([(member_name, bytes or None, error or None)], {member_name: po_number})
+    Oversized or unreadable members come back with contents None and an error message
+    so the caller can report them per document.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Archive is not a valid zip file.")
+    max_member_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    with archive:
+        manifest_info = None
+        pdf_infos = []
+        total_bytes = 0
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/"):
+                continue
+            if os.path.basename(name) == ZIP_MANIFEST_NAME:
+                manifest_info = info
+                continue
+            if not is_allowed_file(name):
+                continue
+            pdf_infos.append(info)
+            if len(pdf_infos) > max_files:
+                raise HTTPException(status_code=400, detail=f"Too many files. Max allowed is {max_files}.")
+            if info.file_size <= max_member_bytes:
+                total_bytes += info.file_size
+        if total_bytes > MAX_ZIP_TOTAL_MB * 1024 * 1024:
+            raise HTTPException(status_code=413, detail=f"Archive too large. Max uncompressed size is {MAX_ZIP_TOTAL_MB} MB.")
+        manifest = {}
+        if manifest_info is not None:
+            if manifest_info.file_size > MAX_MANIFEST_KB * 1024:
+                raise HTTPException(status_code=400, detail=f"Invalid {ZIP_MANIFEST_NAME} in archive.")
+            try:
+                manifest = json.loads(archive.read(manifest_info).decode("utf-8"))
+            except Exception:
+                raise HTTPException(status_code=400, detail=f"Invalid {ZIP_MANIFEST_NAME} in archive.")
+            if not isinstance(manifest, dict) or not all(isinstance(v, str) for v in manifest.values()):
+                raise HTTPException(status_code=400, detail=f"Invalid {ZIP_MANIFEST_NAME} in archive.")
+        members = []
+        for info in pdf_infos:
+            if info.file_size > max_member_bytes:
+                members.append((info.filename, None, f"File too large. Max allowed is {MAX_FILE_SIZE_MB} MB."))
+                continue
+            try:
+                members.append((info.filename, archive.read(info), None))
+            except Exception as e:
+                members.append((info.filename, None, f"Could not read file from archive: {str(e)}"))
+    return members, manifest
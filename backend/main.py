@@ -1,12 +1,29 @@
-from fastapi import FastAPI, UploadFile, Form
+import asyncio
+import json
+import os
+import time
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, Form, File, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from backend.file_handler import is_allowed_file, save_uploaded_file, generate_submission_id
-from backend.ocr_engine import run_ocr_on_images
+from fastapi.responses import JSONResponse, StreamingResponse
+from backend.file_handler import (
+    is_allowed_file, generate_submission_id, save_upload_bytes, rasterize_upload,
+    count_pdf_pages, discard_upload, read_pdfs_from_zip, MAX_FILE_SIZE_MB
+)
+from backend.ocr_engine import submit_interleaved_ocr
 from backend.doc_detector import classify_pages_by_type, detect_document_presence_in_text
-from backend.field_extractor import extract_invoice_fields_from_text
+from backend.field_extractor import extract_invoice_fields_from_text, extract_invoice_fields_batch
 from backend.databases.po_data import PO_DATABASE
+from backend.debug_artifacts import (
+    DebugArtifacts, start_debug_session, get_writer_stats, flush_debug_artifacts
+)
+from backend.admission import AdmissionController, AdmissionRejected, resolve_priority, MAX_CONCURRENT_DOCS
+# Batch limits
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "4"))
+BATCH_PARALLEL_DOCS = int(os.getenv("BATCH_PARALLEL_DOCS", str(MAX_CONCURRENT_DOCS)))
 app = FastAPI()
+admission = AdmissionController()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Restrict in prod
@@ -18,62 +35,312 @@ def _score_invoice_page(text: str) -> int:
     keys = ["tax invoice", "invoice no", "igst", "cgst", "sgst", "total amount", "hsn", "sac", "place of supply", "gstin"]
     t = text.lower()
     return sum(1 for k in keys if k in t)
+def _write_ocr_debug(debug: DebugArtifacts, ocr_text_by_page: dict) -> str | None:
+    if not debug.wants("text"):
+        return None
+    parts = []
+    for page_num, page_text in ocr_text_by_page.items():
+        parts.append(f"\n\n=== OCR TEXT: Page {page_num + 1} ===\n")
+        parts.append(page_text if page_text else "[Empty Page]")
+    return debug.save_text("ocr_text.txt", "".join(parts))
+def _analyze_ocr_text(po_number: str, ocr_text_by_page: dict) -> dict:
+    # Classify document types per page
+    page_doc_types = classify_pages_by_type(ocr_text_by_page)
+    # Check required document types from PO
+    required_docs = PO_DATABASE[po_number]["required_docs"]
+    all_text = " ".join(ocr_text_by_page.values())
+    doc_checklist = detect_document_presence_in_text(all_text, required_docs)
+    # Pick the invoice text to send for field extraction
+    invoice_pages = [p for p, t in page_doc_types.items() if t == "invoice"]
+    if invoice_pages:
+        scored = sorted(invoice_pages, key=lambda p: _score_invoice_page(ocr_text_by_page[p]), reverse=True)
+        top_pages = scored[:2]
+        full_invoice_text = " ".join([ocr_text_by_page[p] for p in top_pages])
+        invoice_text = full_invoice_text[:2500]
+    else:
+        invoice_text = ocr_text_by_page.get(0, "")[:2000]
+    return {
+        "document_checklist": doc_checklist,
+        "page_classification": page_doc_types,
+        "invoice_text": invoice_text,
+    }
+def _build_response(submission_id: str, po_number: str, analysis: dict, extracted_fields: dict,
+                    save_result: dict, debug_file_path: str | None) -> dict:
+    return {
+        "submission_id": submission_id,
+        "po_number": po_number,
+        "document_checklist": analysis["document_checklist"],
+        "page_classification": analysis["page_classification"],
+        "extracted_fields": extracted_fields,
+        "file_info": save_result,
+        "ocr_debug_file": debug_file_path,
+        "validation": "Field validation skipped in current phase."
+    }
+async def _ocr_on_shared_pool(submission_id: str, image_paths: List[str], debug: DebugArtifacts) -> dict:
+    futures = submit_interleaved_ocr({submission_id: image_paths}, {submission_id: debug})[submission_id]
+    texts = await asyncio.gather(*[asyncio.wrap_future(f) for f in futures.values()])
+    return dict(zip(futures.keys(), texts))
+def _rejected_response(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        content={"error": e.reason, "retry_after_s": e.retry_after},
+        status_code=e.status_code,
+        headers={"Retry-After": str(e.retry_after)},
+    )
 @app.get("/health")
 def health():
     return {"status": "ok"}
 @app.get("/version")
 def version():
     return {"version": "mvp-0.1.3"}
+@app.get("/admission")
+def admission_stats():
+    return admission.snapshot()
+@app.get("/debug-artifacts")
+def debug_artifact_stats():
+    return get_writer_stats()
+@app.on_event("shutdown")
+def flush_debug_on_shutdown():
+    flush_debug_artifacts()
 @app.post("/analyze/")
-async def analyze_document(po_number: str = Form(...), file: UploadFile = Form(...)):
+async def analyze_document(po_number: str = Form(...), file: UploadFile = Form(...),
+                           x_priority: Optional[str] = Header(None),
+                           x_priority_key: Optional[str] = Header(None)):
     if po_number not in PO_DATABASE:
         return JSONResponse(content={"error": "Invalid PO Number"}, status_code=400)
     if not is_allowed_file(file.filename):
         return JSONResponse(content={"error": "Only PDF files are allowed."}, status_code=400)
+    priority = resolve_priority(x_priority, x_priority_key)
+    try:
+        admission.check_capacity(priority)
+    except AdmissionRejected as e:
+        return _rejected_response(e)
     submission_id = generate_submission_id()
+    debug = start_debug_session(submission_id)
+    loop = asyncio.get_running_loop()
     try:
-        # STEP 1: Save uploaded PDF and convert to images
-        save_result = await save_uploaded_file(file, submission_id)
-        image_paths = save_result["image_paths"]
-        # STEP 2: OCR on images
-        ocr_text_by_page = run_ocr_on_images(image_paths)
-        # Debug: Save OCR output to file
-        debug_file_path = f"ocr_debug_output_{submission_id}.txt"
-        with open(debug_file_path, "w", encoding="utf-8") as f:
-            for page_num, page_text in ocr_text_by_page.items():
-                f.write(f"\n\n=== OCR TEXT: Page {page_num + 1} ===\n")
-                f.write(page_text if page_text else "[Empty Page]")
-        # STEP 3: Classify document types per page
-        page_doc_types = classify_pages_by_type(ocr_text_by_page)
-        # STEP 4: Check required document types from PO
-        required_docs = PO_DATABASE[po_number]["required_docs"]
-        all_text = " ".join(ocr_text_by_page.values())
-        doc_checklist = detect_document_presence_in_text(all_text, required_docs)
+        # STEP 1: Save uploaded PDF and reserve capacity for its pages
+        save_result = save_upload_bytes(file.filename, await file.read(), submission_id)
+        pages = await loop.run_in_executor(None, count_pdf_pages, save_result["path"])
+        async with admission.admit(pages, priority):
+            # STEP 2: Convert to images and OCR (off the event loop)
+            save_result = await loop.run_in_executor(None, rasterize_upload, save_result, submission_id)
+            ocr_text_by_page = await _ocr_on_shared_pool(submission_id, save_result["image_paths"], debug)
+        # Debug: Queue OCR output dump (written in the background)
+        debug_file_path = _write_ocr_debug(debug, ocr_text_by_page)
+        # STEP 3-4: Classify pages and check required documents from PO
+        analysis = await loop.run_in_executor(None, _analyze_ocr_text, po_number, ocr_text_by_page)
         # STEP 5: Extract invoice fields (if invoice found)
-        invoice_pages = [p for p, t in page_doc_types.items() if t == "invoice"]
-        if invoice_pages:
-            scored = sorted(invoice_pages, key=lambda p: _score_invoice_page(ocr_text_by_page[p]), reverse=True)
-            top_pages = scored[:2]
-            full_invoice_text = " ".join([ocr_text_by_page[p] for p in top_pages])
-            invoice_text = full_invoice_text[:2500]
-        else:
-            invoice_text = ocr_text_by_page.get(0, "")[:2000]
+        invoice_text = analysis["invoice_text"]
         extracted_fields = {}
         if invoice_text:
             try:
-                extracted_fields = extract_invoice_fields_from_text(invoice_text)
+                extracted_fields = await loop.run_in_executor(None, extract_invoice_fields_from_text, invoice_text)
             except Exception as e:
                 extracted_fields = {"error": f"Extraction failed: {str(e)}"}
         # STEP 6: Build response
+        return _build_response(submission_id, po_number, analysis, extracted_fields, save_result, debug_file_path)
+    except AdmissionRejected as e:
+        discard_upload(save_result)
+        return _rejected_response(e)
+    except Exception as e:
+        return JSONResponse(content={"error": f"Server error: {str(e)}"}, status_code=500)
+# ───────────────────────────── Batch analysis ─────────────────────────────
+def _batch_error(doc: dict, message: str) -> dict:
+    record = {
+        "index": doc["index"],
+        "filename": doc["filename"],
+        "po_number": doc["po_number"],
+        "submission_id": doc.get("submission_id"),
+        "status": "error",
+        "error": message,
+    }
+    if "retry_after_s" in doc:
+        record["retry_after_s"] = doc["retry_after_s"]
+    return record
+def _save_batch_doc(doc: dict) -> dict:
+    """Validates and stores one batch document. Errors are recorded on the doc."""
+    submission_id = None
+    try:
+        if doc.get("read_error"):
+            return {**doc, "error": doc["read_error"]}
+        if not isinstance(doc["po_number"], str) or doc["po_number"] not in PO_DATABASE:
+            return {**doc, "error": "Invalid PO Number"}
+        submission_id = generate_submission_id()
+        save_result = save_upload_bytes(doc["filename"], doc["contents"], submission_id)
         return {
-            "submission_id": submission_id,
-            "po_number": po_number,
-            "document_checklist": doc_checklist,
-            "page_classification": page_doc_types,
-            "extracted_fields": extracted_fields,
-            "file_info": save_result,
-            "ocr_debug_file": debug_file_path,
-            "validation": "Field validation skipped in current phase."
+            **doc, "contents": None, "submission_id": submission_id, "save_result": save_result,
+            "pages": count_pdf_pages(save_result["path"]),
+            "debug": start_debug_session(submission_id),
         }
+    except HTTPException as e:
+        return {**doc, "submission_id": submission_id, "error": e.detail}
     except Exception as e:
-        return JSONResponse(content={"error": f"Server error: {str(e)}"}, status_code=500)
\ No newline at end of file
+        return {**doc, "submission_id": submission_id, "error": f"Server error: {str(e)}"}
+async def _run_batch(docs: List[dict], priority: str, out: asyncio.Queue) -> None:
+    """
+    Drives a batch through the shared pipeline and puts one record per document on `out`:
+    1. store each document and reserve admission capacity for its pages
+    2. rasterize and queue its pages on the shared OCR pool, which interleaves
+       pages across every document in flight
+    3. classify each document as soon as its own pages are done
+    4. send invoice texts to the LLM in micro-batches of whatever is ready
+    At most BATCH_PARALLEL_DOCS documents of one batch are in steps 1-3 at a time,
+    so a large batch cannot fill the admission queue by itself.
+    """
+    loop = asyncio.get_running_loop()
+    reported = set()
+    gate = asyncio.Semaphore(BATCH_PARALLEL_DOCS)
+    pending: asyncio.Queue = asyncio.Queue()
+    async def report(record: dict):
+        reported.add(record["index"])
+        await out.put(record)
+    async def process_doc(doc: dict):
+        # Whatever happens, exactly one entry per document reaches `pending`
+        try:
+            async with gate:
+                doc = await loop.run_in_executor(None, _save_batch_doc, doc)
+                if "error" in doc:
+                    return
+                submission_id = doc["submission_id"]
+                async with admission.admit(doc["pages"], priority):
+                    doc["save_result"] = await loop.run_in_executor(
+                        None, rasterize_upload, doc["save_result"], submission_id
+                    )
+                    ocr_text_by_page = await _ocr_on_shared_pool(
+                        submission_id, doc["save_result"]["image_paths"], doc["debug"]
+                    )
+                doc["debug_file"] = _write_ocr_debug(doc["debug"], ocr_text_by_page)
+                doc["analysis"] = await loop.run_in_executor(None, _analyze_ocr_text, doc["po_number"], ocr_text_by_page)
+        except AdmissionRejected as e:
+            discard_upload(doc["save_result"])
+            doc = {**doc, "error": e.reason, "retry_after_s": e.retry_after}
+        except Exception as e:
+            doc = {**doc, "error": f"Server error: {str(e)}"}
+        finally:
+            await pending.put(doc)
+    async def extract_ready():
+        remaining = len(docs)
+        while remaining:
+            batch = [await pending.get()]
+            while len(batch) < LLM_BATCH_SIZE and not pending.empty():
+                batch.append(pending.get_nowait())
+            remaining -= len(batch)
+            for doc in batch:
+                if "error" in doc:
+                    await report(_batch_error(doc, doc["error"]))
+            to_extract = [d for d in batch if "error" not in d and d["analysis"]["invoice_text"]]
+            try:
+                fields = await loop.run_in_executor(
+                    None, extract_invoice_fields_batch, [d["analysis"]["invoice_text"] for d in to_extract]
+                )
+            except Exception as e:
+                fields = [{"error": f"Extraction failed: {str(e)}"}] * len(to_extract)
+            fields_by_index = {d["index"]: f for d, f in zip(to_extract, fields)}
+            for doc in batch:
+                if "error" in doc:
+                    continue
+                response = _build_response(
+                    doc["submission_id"], doc["po_number"], doc["analysis"],
+                    fields_by_index.get(doc["index"], {}), doc["save_result"], doc["debug_file"]
+                )
+                await report({"index": doc["index"], "filename": doc["filename"], "status": "ok", **response})
+    tasks = [asyncio.create_task(extract_ready())] + [asyncio.create_task(process_doc(d)) for d in docs]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception as e:
+        for doc in docs:
+            if doc["index"] not in reported:
+                await report(_batch_error(doc, f"Server error: {str(e)}"))
+    finally:
+        # Never leave siblings storing, holding admission slots or running OCR for nobody
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+@app.post("/analyze/batch/")
+async def analyze_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    po_numbers: Optional[List[str]] = Form(None),
+    archive: Optional[UploadFile] = File(None),
+    po_number: Optional[str] = Form(None),
+    x_priority: Optional[str] = Header(None),
+    x_priority_key: Optional[str] = Header(None),
+):
+    """
+    Analyzes many PDFs in one call. Send either `files` with a matching `po_numbers`
+    list (or a single `po_number` for all), or a zip `archive` with an optional
+    manifest.json of {pdf_name: po_number}.
+    Streams NDJSON: one line per document as it completes, then a `summary` line.
+    Documents go through admission control individually; ones that cannot be admitted
+    are reported as errors with `retry_after_s`.
+    """
+    priority = resolve_priority(x_priority, x_priority_key)
+    try:
+        admission.check_capacity(priority)
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+    docs = []
+    files = files or []
+    po_numbers = po_numbers or []
+    if len(files) > BATCH_MAX_FILES:
+        return JSONResponse(content={"error": f"Too many files. Max allowed is {BATCH_MAX_FILES}."}, status_code=400)
+    if files:
+        if po_numbers and len(po_numbers) != len(files):
+            return JSONResponse(content={"error": "po_numbers must match the number of files."}, status_code=400)
+        if not po_numbers and not po_number:
+            return JSONResponse(content={"error": "Provide po_numbers or a po_number for all files."}, status_code=400)
+        for i, f in enumerate(files):
+            doc = {"filename": f.filename, "po_number": po_numbers[i] if po_numbers else po_number}
+            # Don't pull an oversized upload into memory just to reject it
+            if f.size is not None and f.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                doc.update(contents=None, read_error=f"File too large. Max allowed is {MAX_FILE_SIZE_MB} MB.")
+            else:
+                doc["contents"] = await f.read()
+            docs.append(doc)
+    if archive is not None:
+        try:
+            # Decompression can take a while; keep it off the event loop
+            members, manifest = await asyncio.get_running_loop().run_in_executor(
+                None, read_pdfs_from_zip, await archive.read(), BATCH_MAX_FILES - len(docs)
+            )
+        except HTTPException as e:
+            return JSONResponse(content={"error": e.detail}, status_code=e.status_code)
+        for name, contents, read_error in members:
+            docs.append({
+                "filename": name,
+                "po_number": manifest.get(name) or manifest.get(os.path.basename(name)) or po_number,
+                "contents": contents,
+                "read_error": read_error,
+            })
+    if not docs:
+        return JSONResponse(content={"error": "No PDF files provided."}, status_code=400)
+    if len(docs) > BATCH_MAX_FILES:
+        return JSONResponse(content={"error": f"Too many files. Max allowed is {BATCH_MAX_FILES}."}, status_code=400)
+    for i, doc in enumerate(docs):
+        doc["index"] = i
+    async def stream():
+        started = time.perf_counter()
+        out: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(_run_batch(docs, priority, out))
+        succeeded = failed = pages = 0
+        try:
+            for _ in range(len(docs)):
+                record = await out.get()
+                if record["status"] == "ok":
+                    succeeded += 1
+                    pages += len(record["file_info"].get("image_paths", []))
+                else:
+                    failed += 1
+                yield json.dumps(record) + "\n"
+            await task
+            yield json.dumps({"summary": {
+                "total": len(docs),
+                "succeeded": succeeded,
+                "failed": failed,
+                "pages": pages,
+                "elapsed_s": round(time.perf_counter() - started, 2),
+            }}) + "\n"
+        finally:
+            # Client went away: stop OCR/LLM work and give back admission capacity
+            if not task.done():
+                task.cancel()
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
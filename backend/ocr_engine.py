@@ -1,4 +1,8 @@
+import heapq
+import itertools
 import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pdf2image import convert_from_path
 from pytesseract import image_to_string, image_to_osd, Output  # type: ignore
 from PIL import Image
@@ -9,15 +13,20 @@ import cv2
 import os
 import pytesseract
 import re
-
-# Debug output directory
-DEBUG_DIR = "debug_output"
-os.makedirs(DEBUG_DIR, exist_ok=True)
+from backend.debug_artifacts import DebugArtifacts, NO_DEBUG
 
 # Tesseract configs
 TESSERACT_OCR_CONFIG = "--psm 6 -c preserve_interword_spaces=1"
 TESSERACT_OSD_CONFIG = "--psm 0"
 
+# Shared page pool for batch OCR. Tesseract runs out-of-process, so threads keep all cores busy.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 4)))
+_OCR_POOL = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+# Pending pages ordered by (page index, arrival) so documents admitted later still interleave
+_page_heap: list = []
+_page_heap_lock = threading.Lock()
+_page_seq = itertools.count()
+
 def _alnum_ratio(txt: str) -> float:
     if not txt:
         return 0.0
@@ -84,7 +93,7 @@ def _safe_deskew(binary: np.ndarray, allow: bool) -> np.ndarray:
 def _ocr_numpy(binary: np.ndarray) -> str:
     return image_to_string(Image.fromarray(binary), lang="eng", config=TESSERACT_OCR_CONFIG)
 
-def _try_ocr_variants(pil_image: Image.Image, page_num: int | None) -> Tuple[str, np.ndarray]:
+def _try_ocr_variants(pil_image: Image.Image, page_num: int | None, debug: DebugArtifacts = NO_DEBUG) -> Tuple[str, np.ndarray]:
     grayA = np.array(pil_image.convert("L"))
     binA = _binarize(grayA)
     txtA = _ocr_numpy(binA)
@@ -109,13 +118,10 @@ def _try_ocr_variants(pil_image: Image.Image, page_num: int | None) -> Tuple[str
     scoreC = _alnum_ratio(txtC)
 
     if page_num:
-        try:
-            Image.fromarray(binA).save(os.path.join(DEBUG_DIR, f"page_{page_num:03}_A_norotate.png"))
-            Image.fromarray(binC).save(os.path.join(DEBUG_DIR, f"page_{page_num:03}_C_deskew.png"))
-            if binB is not None:
-                Image.fromarray(binB).save(os.path.join(DEBUG_DIR, f"page_{page_num:03}_B_osd.png"))
-        except Exception:
-            pass
+        debug.save_image(f"page_{page_num:03}_A_norotate.png", binA)
+        debug.save_image(f"page_{page_num:03}_C_deskew.png", binC)
+        if binB is not None:
+            debug.save_image(f"page_{page_num:03}_B_osd.png", binB)
 
     candidates = [("A", scoreA, txtA, binA), ("C", scoreC, txtC, binC)]
     if binB is not None:
@@ -124,18 +130,13 @@ def _try_ocr_variants(pil_image: Image.Image, page_num: int | None) -> Tuple[str
     chosen_tag, _, chosen_txt, chosen_bin = max(candidates, key=lambda x: x[1])
 
     if page_num and chosen_bin is not None:
-        try:
-            Image.fromarray(chosen_bin).save(os.path.join(DEBUG_DIR, f"page_{page_num:03}_final.png"))
-        except Exception:
-            pass
+        debug.save_image(f"page_{page_num:03}_final.png", chosen_bin, level="final")
 
     return chosen_txt.strip(), chosen_bin if chosen_bin is not None else binA
 
-def extract_text_from_image(pil_image: Image.Image, page_num: int | None = None) -> str:
+def extract_text_from_image(pil_image: Image.Image, page_num: int | None = None, debug: DebugArtifacts = NO_DEBUG) -> str:
     try:
-        text, final_bin = _try_ocr_variants(pil_image, page_num)
-        if page_num is not None and final_bin is not None:
-            Image.fromarray(final_bin).save(os.path.join(DEBUG_DIR, f"page{page_num:03}_final.png"))
+        text, _ = _try_ocr_variants(pil_image, page_num, debug)
         return text
     except Exception as e:
         logging.error(f"[OCR Error - Page {page_num}]: {str(e)}")
@@ -150,14 +151,48 @@ def extract_text_from_pdf(pdf_path: str) -> str:
             all_text.append(f"\n--- Page {i + 1} ---\n{page_text}")
     return "\n".join(all_text).strip()
 
-def run_ocr_on_images(image_paths: List[str]) -> Dict[int, str]:
+def _ocr_image_file(image_path: str, page_num: int, debug: DebugArtifacts = NO_DEBUG) -> str:
+    try:
+        img = Image.open(image_path)
+        return extract_text_from_image(img, page_num=page_num, debug=debug)
+    except Exception as e:
+        logging.error(f"Failed OCR on image {image_path}: {e}")
+        return ""
+
+def run_ocr_on_images(image_paths: List[str], debug: DebugArtifacts = NO_DEBUG) -> Dict[int, str]:
     results: Dict[int, str] = {}
     for i, image_path in enumerate(image_paths):
-        try:
-            img = Image.open(image_path)
-            text = extract_text_from_image(img, page_num=i + 1)
-            results[i] = text
-        except Exception as e:
-            logging.error(f"Failed OCR on image {image_path}: {e}")
-            results[i] = ""
+        results[i] = _ocr_image_file(image_path, i + 1, debug)
     return results
+
+def _run_next_page() -> None:
+    with _page_heap_lock:
+        _, _, image_path, page_num, debug, future = heapq.heappop(_page_heap)
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(_ocr_image_file(image_path, page_num, debug))
+    except Exception as e:
+        future.set_exception(e)
+
+def submit_interleaved_ocr(image_paths_by_doc: Dict[str, List[str]],
+                           debug_by_doc: Dict[str, DebugArtifacts] | None = None) -> Dict[str, Dict[int, Future]]:
+    """
+    Queues pages of one or more documents on the shared OCR pool, which both /analyze/
+    and /analyze/batch/ use. Workers always take the lowest page index waiting (page 1
+    of every doc, then page 2, ...), including pages from documents submitted by other
+    requests, so small documents finish early and no single large PDF monopolises the
+    workers.
+    Returns: {doc_key: {page_index: Future[str]}}
+    """
+    debug_by_doc = debug_by_doc or {}
+    futures: Dict[str, Dict[int, Future]] = {key: {} for key in image_paths_by_doc}
+    for key, paths in image_paths_by_doc.items():
+        debug = debug_by_doc.get(key, NO_DEBUG)
+        for i, path in enumerate(paths):
+            future: Future = Future()
+            futures[key][i] = future
+            with _page_heap_lock:
+                heapq.heappush(_page_heap, (i, next(_page_seq), path, i + 1, debug, future))
+            _OCR_POOL.submit(_run_next_page)
+    return futures
@@ -1,17 +1,31 @@
 import requests
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 MODEL_DEFAULT = os.getenv("OLLAMA_MODEL", "llama3:8b")
 TIMEOUT_S = int(os.getenv("OLLAMA_TIMEOUT", "180"))
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
-def call_llm_with_prompt(prompt: str, model: str = MODEL_DEFAULT) -> str:
+# Keep the model resident between calls so batches don't pay warm-up per document
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+# Should match the server's OLLAMA_NUM_PARALLEL; extra requests just queue inside Ollama
+NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "2"))
+# Keep-alive connections shared by single-document calls (request threads) and batch calls
+HTTP_POOL_SIZE = int(os.getenv("OLLAMA_HTTP_POOL_SIZE", "16"))
+_session = requests.Session()
+_session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+# Batch prompts only; single-document calls never queue behind a batch here
+_LLM_POOL = ThreadPoolExecutor(max_workers=NUM_PARALLEL, thread_name_prefix="llm")
+def _post_prompt(prompt: str, model: str) -> str:
     try:
-        response = requests.post(
+        response = _session.post(
             OLLAMA_URL,
             json={
                 "model": model,
                 "prompt": prompt,
-                "stream": False
+                "stream": False,
+                "keep_alive": KEEP_ALIVE
             },
             timeout=TIMEOUT_S
         )
@@ -20,4 +34,12 @@ def call_llm_with_prompt(prompt: str, model: str = MODEL_DEFAULT) -> str:
         return (data.get("response") or "").strip()
     except Exception as e:
         logging.error(f"Ollama LLM call failed: {e}")
-        return ""
\ No newline at end of file
+        return ""
+def call_llm_with_prompt(prompt: str, model: str = MODEL_DEFAULT) -> str:
+    return _post_prompt(prompt, model)
+def call_llm_batch(prompts: List[str], model: str = MODEL_DEFAULT) -> List[str]:
+    """
+    Runs several prompts over the shared keep-alive session, at most NUM_PARALLEL at a time.
+    Output order matches input order; failed prompts come back as "".
+    """
+    return list(_LLM_POOL.map(lambda p: _post_prompt(p, model), prompts))
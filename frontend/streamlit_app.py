@@ -1,154 +1,324 @@
 import streamlit as st
 import requests
 import json
+import hashlib
+import time
+import pandas as pd
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
-def _get_api_base():
+def _get_secret(name, default):
     try:
-        return st.secrets.get("API_BASE", "http://127.0.0.1:8000")
+        return st.secrets.get(name, default)
     except Exception:
-        return "http://127.0.0.1:8000"
+        return default
 
-API_BASE = _get_api_base()
+API_BASE = _get_secret("API_BASE", "http://127.0.0.1:8000")
+# Must match the backend's ADMISSION_INTERACTIVE_KEY for uploads to be served as interactive
+PRIORITY_KEY = _get_secret("PRIORITY_KEY", "")
 ANALYZE_URL = f"{API_BASE}/analyze/"
 HEALTH_URL = f"{API_BASE}/health"
 VERSION_URL = f"{API_BASE}/version"
 
+MAX_PARALLEL_UPLOADS = 8
+MAX_BUSY_RETRIES = 2
+MAX_RETRY_WAIT_S = 30
+
 st.set_page_config(page_title="📄 Bill Verifier", layout="centered")
-st.title("📤 Upload & Analyze Document")
+st.title("📤 Upload & Analyze Documents")
 
-# Sidebar: backend status
-with st.sidebar:
-    st.header("Backend status")
+@st.cache_resource
+def _get_session():
+    # One pooled session shared by every rerun and upload worker
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL_UPLOADS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _get_backend_status():
+    status = {"health": None, "version": None, "error": None}
+    session = _get_session()
     try:
-        health = requests.get(HEALTH_URL, timeout=10).json()
-        st.success(f"Health: {health.get('status','ok')}")
+        status["health"] = session.get(HEALTH_URL, timeout=10).json().get("status", "ok")
     except Exception as e:
-        st.error(f"Health: unavailable ({e})")
+        status["error"] = str(e)
+        return status
     try:
-        ver = requests.get(VERSION_URL, timeout=10).json()
-        st.info(f"Version: {ver.get('version','unknown')}")
+        status["version"] = session.get(VERSION_URL, timeout=10).json().get("version", "unknown")
     except Exception:
         pass
+    return status
+
+def _cache_key(file_hash, po_number):
+    return f"{file_hash}:{po_number}"
+
+def _analyze_one(session, job, timeout, results, errors, inflight):
+    """
+    Runs in an upload worker thread: no st.* calls here. The outcome is written straight
+    into the session-level `results`/`errors` dicts, so it is kept even if a rerun
+    interrupts the script before the progress loop sees it.
+    Retries 429/503 responses after the server's Retry-After (capped).
+    """
+    key, progress = job["key"], job["progress"]
+    headers = {"X-Priority": "interactive"}
+    if PRIORITY_KEY:
+        headers["X-Priority-Key"] = PRIORITY_KEY
+    progress["status"] = "running"
+    progress["started"] = time.time()
+    try:
+        for attempt in range(MAX_BUSY_RETRIES + 1):
+            files = {"file": (job["name"], job["data"], "application/pdf")}
+            resp = session.post(
+                ANALYZE_URL,
+                data={"po_number": job["po_number"]},
+                files=files,
+                headers=headers,
+                timeout=timeout,
+            )
+            if resp.status_code in (429, 503) and attempt < MAX_BUSY_RETRIES:
+                try:
+                    wait_s = int(resp.headers.get("Retry-After", "5"))
+                except ValueError:
+                    wait_s = 5
+                progress["status"] = f"server busy, retrying in {min(wait_s, MAX_RETRY_WAIT_S)}s"
+                time.sleep(min(wait_s, MAX_RETRY_WAIT_S))
+                progress["status"] = "running"
+                continue
+            break
+        try:
+            payload = resp.json()
+        except Exception:
+            payload = resp.text
+        if resp.status_code == 200 and isinstance(payload, dict):
+            results[key] = payload
+            errors.pop(key, None)
+            progress["status"] = "✅ done"
+        else:
+            errors[key] = payload
+            progress["status"] = f"❌ HTTP {resp.status_code}"
+    except requests.exceptions.Timeout:
+        errors[key] = "Request timed out. Increase the timeout in Advanced settings and try again."
+        progress["status"] = "⏳ timed out"
+    except Exception as e:
+        errors[key] = f"Request failed: {str(e)}"
+        progress["status"] = "🚨 failed"
+    finally:
+        progress["finished"] = time.time()
+        inflight.pop(key, None)
+
+def _progress_rows(jobs):
+    rows = []
+    now = time.time()
+    for job in jobs:
+        p = job["progress"]
+        elapsed = ""
+        if p.get("started"):
+            elapsed = f"{(p.get('finished') or now) - p['started']:.0f}s"
+        rows.append({"File": job["name"], "PO Number": job["po_number"], "Status": p["status"], "Elapsed": elapsed})
+    return pd.DataFrame(rows)
+
+def _render_result(result, widget_key):
+    # Top metadata
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write(f"Submission ID: {result.get('submission_id','-')}")
+        st.write(f"PO Number: {result.get('po_number','-')}")
+    with col2:
+        file_info = result.get("file_info", {}) or {}
+        st.write(f"Uploaded at: {file_info.get('uploaded_at','-')}")
+        st.write(f"File size: {file_info.get('size_mb','-')} MB")
+
+    # Document presence checklist
+    if "document_checklist" in result:
+        st.subheader("📋 Document Presence Checklist")
+        checks = result.get("document_checklist") or {}
+        if not checks:
+            st.info("No checklist returned.")
+        else:
+            cols = st.columns(max(1, len(checks)))
+            for idx, (doc, present) in enumerate(checks.items()):
+                badge = "✅" if present else "❌"
+                label = doc.replace("_", " ").title() if isinstance(doc, str) else str(doc)
+                cols[idx % len(cols)].markdown(f"{badge} **{label}**")
+
+    # Page classification
+    if "page_classification" in result:
+        st.subheader("📄 Page Classification")
+        pc = result.get("page_classification") or {}
+        buckets = {}
+        for p, t in pc.items():
+            try:
+                page_idx = int(p) + 1
+            except Exception:
+                try:
+                    page_idx = int(p)
+                except Exception:
+                    page_idx = p
+            label = (t or "unknown")
+            buckets.setdefault(label, []).append(page_idx)
+
+        for doc_type, pages in buckets.items():
+            try:
+                pages_sorted = sorted(
+                    pages,
+                    key=lambda x: int(x) if isinstance(x, (int, str)) and str(x).isdigit() else 0
+                )
+            except Exception:
+                pages_sorted = pages
+            doc_label = (doc_type if isinstance(doc_type, str) else str(doc_type)).replace("_", " ").title()
+            st.write(f"- {doc_label}: {len(pages_sorted)} page(s) → {pages_sorted}")
+
+    # Extracted fields
+    if "extracted_fields" in result:
+        st.subheader("🧾 Extracted Invoice Fields")
+        st.json(result["extracted_fields"])
+
+    # Validation info
+    if "validation" in result:
+        st.subheader("🔍 Field Validation")
+        v = result["validation"]
+        if isinstance(v, str):
+            st.info(v)
+        elif isinstance(v, dict):
+            st.write(v)
+        else:
+            st.warning("Unexpected validation format.")
+
+    # Debug artifacts
+    if result.get("ocr_debug_file"):
+        st.caption(f"🛠 Debug artifacts: `{result['ocr_debug_file']}`")
+
+    # Raw JSON download
+    st.json(result, expanded=False)
+    buf = BytesIO(json.dumps(result, indent=2).encode("utf-8"))
+    st.download_button(
+        "Download JSON",
+        data=buf,
+        file_name=f"analysis_{result.get('submission_id','output')}.json",
+        mime="application/json",
+        key=f"download_{widget_key}"
+    )
+
+# Completed analyses survive reruns: {"<sha256>:<po>": result}
+analysis_cache = st.session_state.setdefault("analysis_cache", {})
+analysis_errors = st.session_state.setdefault("analysis_errors", {})
+# Uploads still running, possibly started by an earlier (interrupted) run: {key: progress}
+analysis_inflight = st.session_state.setdefault("analysis_inflight", {})
+
+# Sidebar: backend status (cached for a short TTL, not re-probed on every rerun)
+with st.sidebar:
+    st.header("Backend status")
+    backend = _get_backend_status()
+    if backend["error"]:
+        st.error(f"Health: unavailable ({backend['error']})")
+    else:
+        st.success(f"Health: {backend['health']}")
+        if backend["version"]:
+            st.info(f"Version: {backend['version']}")
+    if st.button("Refresh status"):
+        _get_backend_status.clear()
+        st.rerun()
+    st.caption(f"Cached analyses this session: {len(analysis_cache)}")
+    if analysis_cache and st.button("Clear cached analyses"):
+        analysis_cache.clear()
+        analysis_errors.clear()
+        st.rerun()
 
 # Step 1: Input
-po_number = st.text_input("Enter PO Number:", placeholder="e.g., PO12345")
-uploaded_file = st.file_uploader("Upload merged PDF (Invoice + MPR + Salary proofs)", type=["pdf"])
+default_po = st.text_input("Default PO Number:", placeholder="e.g., PO12345")
+uploaded_files = st.file_uploader(
+    "Upload merged PDFs (Invoice + MPR + Salary proofs), one per bill",
+    type=["pdf"],
+    accept_multiple_files=True
+)
 
 # Optional: advanced section
 with st.expander("Advanced", expanded=False):
     st.caption("These affect only the request handling on the client side.")
     req_timeout = st.number_input("Request Timeout (seconds)", min_value=60, max_value=900, value=300, step=30)
+    parallel_uploads = st.number_input("Parallel uploads", min_value=1, max_value=MAX_PARALLEL_UPLOADS, value=3, step=1)
+
+# Step 2: PO number per file
+jobs = []
+if uploaded_files:
+    st.subheader("🗂 Files")
+    st.caption("Edit the PO Number per file if it differs from the default.")
+    po_table = st.data_editor(
+        pd.DataFrame({"File": [f.name for f in uploaded_files], "PO Number": [default_po] * len(uploaded_files)}),
+        disabled=["File"],
+        hide_index=True,
+        use_container_width=True,
+        # Reset per-file edits when the default PO or the file selection changes
+        key="po_table_" + hashlib.sha1("|".join([default_po] + [f.name for f in uploaded_files]).encode()).hexdigest()
+    )
+    seen_keys = set()
+    for f, po in zip(uploaded_files, po_table["PO Number"]):
+        data = f.getvalue()
+        po = (po or "").strip()
+        key = _cache_key(hashlib.sha256(data).hexdigest(), po)
+        # The same bytes under the same PO are one analysis
+        if key in seen_keys:
+            st.caption(f"Skipping {f.name}: identical to another file with the same PO Number.")
+            continue
+        seen_keys.add(key)
+        if key in analysis_inflight:
+            progress = analysis_inflight[key]
+        else:
+            progress = {"status": "cached" if key in analysis_cache else "queued"}
+        jobs.append({"name": f.name, "data": data, "po_number": po, "key": key, "progress": progress})
 
 # Analyze button
-analyze_disabled = not (uploaded_file and po_number)
+missing_po = [j["name"] for j in jobs if not j["po_number"]]
+analyze_disabled = not jobs or bool(missing_po)
+if missing_po:
+    st.warning(f"Enter a PO Number for: {', '.join(missing_po)}")
 if st.button("Analyze", disabled=analyze_disabled, type="primary"):
-    if not po_number:
-        st.warning("Please enter a PO Number.")
-    elif not uploaded_file:
-        st.warning("Please upload a PDF file.")
+    to_send = [j for j in jobs if j["key"] not in analysis_cache and j["key"] not in analysis_inflight]
+    if not to_send and not any(j["key"] in analysis_inflight for j in jobs):
+        st.info("All files already analyzed in this session; showing cached results.")
     else:
-        with st.spinner("Analyzing document... This may take a few minutes for large PDFs."):
-            try:
-                files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
-                data = {"po_number": po_number}
-                resp = requests.post(ANALYZE_URL, data=data, files=files, timeout=int(req_timeout))
-
-                if resp.status_code == 200:
-                    result = resp.json()
-                    st.success("✅ File analyzed successfully.")
-
-                    # Top metadata
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"Submission ID: {result.get('submission_id','-')}")
-                        st.write(f"PO Number: {result.get('po_number','-')}")
-                    with col2:
-                        file_info = result.get("file_info", {}) or {}
-                        st.write(f"Uploaded at: {file_info.get('uploaded_at','-')}")
-                        st.write(f"File size: {file_info.get('size_mb','-')} MB")
-
-                    # Document presence checklist
-                    if "document_checklist" in result:
-                        st.subheader("📋 Document Presence Checklist")
-                        checks = result.get("document_checklist") or {}
-                        if not checks:
-                            st.info("No checklist returned.")
-                        else:
-                            cols = st.columns(max(1, len(checks)))
-                            for idx, (doc, present) in enumerate(checks.items()):
-                                badge = "✅" if present else "❌"
-                                label = doc.replace("_", " ").title() if isinstance(doc, str) else str(doc)
-                                cols[idx % len(cols)].markdown(f"{badge} **{label}**")
-
-                    # Page classification
-                    if "page_classification" in result:
-                        st.subheader("📄 Page Classification")
-                        pc = result.get("page_classification") or {}
-                        buckets = {}
-                        for p, t in pc.items():
-                            try:
-                                page_idx = int(p) + 1
-                            except Exception:
-                                try:
-                                    page_idx = int(p)
-                                except Exception:
-                                    page_idx = p
-                            label = (t or "unknown")
-                            buckets.setdefault(label, []).append(page_idx)
-
-                        for doc_type, pages in buckets.items():
-                            try:
-                                pages_sorted = sorted(
-                                    pages,
-                                    key=lambda x: int(x) if isinstance(x, (int, str)) and str(x).isdigit() else 0
-                                )
-                            except Exception:
-                                pages_sorted = pages
-                            doc_label = (doc_type if isinstance(doc_type, str) else str(doc_type)).replace("_", " ").title()
-                            st.write(f"- {doc_label}: {len(pages_sorted)} page(s) → {pages_sorted}")
-
-                    # Extracted fields
-                    if "extracted_fields" in result:
-                        st.subheader("🧾 Extracted Invoice Fields")
-                        st.json(result["extracted_fields"])
-
-                    # Validation info
-                    if "validation" in result:
-                        st.subheader("🔍 Field Validation")
-                        v = result["validation"]
-                        if isinstance(v, str):
-                            st.info(v)
-                        elif isinstance(v, dict):
-                            st.write(v)
-                        else:
-                            st.warning("Unexpected validation format.")
-
-                    # Debug artifacts
-                    if "ocr_debug_file" in result:
-                        with st.expander("🛠 Debug Artifacts"):
-                            st.code(result["ocr_debug_file"])
-
-                    # Raw JSON download
-                    with st.expander("📦 Full JSON Response", expanded=False):
-                        st.json(result)
-                        buf = BytesIO(json.dumps(result, indent=2).encode("utf-8"))
-                        st.download_button(
-                            "Download JSON",
-                            data=buf,
-                            file_name=f"analysis_{result.get('submission_id','output')}.json",
-                            mime="application/json"
-                        )
+        session = _get_session()
+        # Not a `with` block: a rerun must not wait for (or lose) uploads already in progress
+        pool = ThreadPoolExecutor(max_workers=int(parallel_uploads))
+        for j in to_send:
+            analysis_inflight[j["key"]] = j["progress"]
+            pool.submit(_analyze_one, session, j, int(req_timeout), analysis_cache, analysis_errors, analysis_inflight)
+        pool.shutdown(wait=False)
+
+# Live progress while any upload of the current selection is running
+if any(j["key"] in analysis_inflight for j in jobs):
+    table = st.empty()
+    bar = st.progress(0.0, text="Analyzing documents...")
+    # Only uploads actually sent: still in flight, or already finished (workers set
+    # "finished" before leaving analysis_inflight). Unsent "queued" files are not counted.
+    tracked = [j for j in jobs if j["key"] in analysis_inflight or j["progress"].get("finished")]
+    while True:
+        running = sum(1 for j in tracked if j["key"] in analysis_inflight)
+        finished = len(tracked) - running
+        table.dataframe(_progress_rows(jobs), hide_index=True, use_container_width=True)
+        bar.progress(finished / max(1, len(tracked)), text=f"Analyzed {finished}/{len(tracked)} document(s)")
+        if not running:
+            break
+        time.sleep(0.5)
+    bar.empty()
 
+# Step 3: Results for the current selection (served from the session cache on reruns)
+if jobs:
+    shown = [j for j in jobs if j["key"] in analysis_cache or j["key"] in analysis_errors]
+    if shown:
+        st.subheader("📑 Results")
+        ok = sum(1 for j in shown if j["key"] in analysis_cache)
+        st.write(f"✅ {ok} analyzed · ❌ {len(shown) - ok} failed · {len(jobs) - len(shown)} not yet sent")
+    for job in shown:
+        if job["key"] in analysis_cache:
+            with st.expander(f"✅ {job['name']} ({job['po_number']})"):
+                _render_result(analysis_cache[job["key"]], job["key"])
+        else:
+            with st.expander(f"❌ {job['name']} ({job['po_number']})", expanded=True):
+                error = analysis_errors[job["key"]]
+                if isinstance(error, (dict, list)):
+                    st.json(error)
                 else:
-                    st.error(f"❌ Analysis failed (HTTP {resp.status_code}).")
-                    try:
-                        st.json(resp.json())
-                    except Exception:
-                        st.text(resp.text)
-
-            except requests.exceptions.Timeout:
-                st.error("⏳ Request timed out. Increase the timeout in Advanced settings and try again.")
-            except Exception as e:
-                st.error(f"🚨 Request failed: {str(e)}")
-                
\ No newline at end of file
+                    st.text(error)